@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g
 from flask_cors import CORS
 import numpy as np
 import pandas as pd
@@ -8,13 +8,31 @@ import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize, sent_tokenize
 from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score
+from sklearn.preprocessing import normalize
+from scipy import sparse
 import joblib
+import emotion_model
 import os
+import sys
 import json
+import copy
+import fcntl
+import tempfile
+import uuid
+import hashlib
+import math
+import time
+import queue
+import threading
+import random
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict, deque
 from datetime import datetime
+from functools import lru_cache, wraps
 
 # Configure logging
 logging.basicConfig(
@@ -45,6 +63,59 @@ except LookupError:
 MODEL_PATH = os.path.join('models', 'fake_news_model.pkl')
 VECTORIZER_PATH = os.path.join('models', 'tfidf_vectorizer.pkl')
 FEATURE_NAMES_PATH = os.path.join('models', 'feature_names.json')
+ONLINE_MODEL_PATH = os.path.join('models', 'online_model.pkl')
+HOLDOUT_PATH = os.path.join('models', 'holdout.pkl')
+SNAPSHOT_DIR = os.path.join('models', 'snapshots')
+FEEDBACK_DIR = os.path.join('models', 'feedback')
+SERVING_CONFIG_PATH = os.environ.get('SERVING_CONFIG', os.path.join('models', 'serving.json'))
+
+# Online learning settings
+FEEDBACK_QUEUE_SIZE = int(os.environ.get('FEEDBACK_QUEUE_SIZE', 10000))
+FEEDBACK_BATCH_SIZE = int(os.environ.get('FEEDBACK_BATCH_SIZE', 32))
+FEEDBACK_BATCH_WAIT = float(os.environ.get('FEEDBACK_BATCH_WAIT', 5.0))  # Seconds to wait for a full batch
+FEEDBACK_F1_TOLERANCE = float(os.environ.get('FEEDBACK_F1_TOLERANCE', 0.01))  # Allowed held-out F1 drop
+FEEDBACK_POLL_INTERVAL = float(os.environ.get('FEEDBACK_POLL_INTERVAL', 0.5))  # Seconds between spool checks
+SNAPSHOT_POLL_INTERVAL = float(os.environ.get('SNAPSHOT_POLL_INTERVAL', 5.0))  # Seconds between snapshot checks
+
+# Admission control settings
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 4))  # Requests processed at once
+MAX_QUEUED = int(os.environ.get('MAX_QUEUED', 16))  # Requests waiting for a slot
+QUEUE_TIMEOUT = float(os.environ.get('QUEUE_TIMEOUT', 2.0))  # Seconds a request may wait for a slot
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 60))  # Token refill rate per client
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 20))  # Token bucket capacity per client
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 2 * 1024 * 1024))  # Bytes
+MAX_TEXT_LENGTH = int(os.environ.get('MAX_TEXT_LENGTH', 200000))  # Characters
+
+# Optional outputs of /api/analyze; the prediction itself is always returned
+ANALYZE_OUTPUTS = ('features', 'additional_features')
+ANALYSIS_CACHE_BYTES = int(os.environ.get('ANALYSIS_CACHE_BYTES', 32 * 1024 * 1024))  # Memory for /api/explain results
+
+# Seconds a request may take from arrival, including time spent waiting for a slot
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 5.0))
+EMOTION_REQUEST_DEADLINE = float(os.environ.get('EMOTION_REQUEST_DEADLINE', 10.0))
+
+# Seconds of the request deadline that must be left for a stage to start
+STAGE_BUDGETS = {
+    'preprocess': float(os.environ.get('PREPROCESS_BUDGET', 0.5)),
+    'sentences': float(os.environ.get('SENTENCES_BUDGET', 1.0)),
+    'vectorize': float(os.environ.get('VECTORIZE_BUDGET', 0.1)),
+    'predict': float(os.environ.get('PREDICT_BUDGET', 0.1)),
+    'explain': float(os.environ.get('EXPLAIN_BUDGET', 0.5)),
+    'decode': float(os.environ.get('DECODE_BUDGET', 1.0)),
+    'detect': float(os.environ.get('DETECT_BUDGET', 2.0)),
+    'classify': float(os.environ.get('CLASSIFY_BUDGET', 1.0))
+}
+
+# Emotion detection settings
+EMOTION_MODELS_DIR = os.environ.get('EMOTION_MODELS_DIR', os.path.join('public', 'models'))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 2))  # Threads decoding and resizing images
+EMOTION_BATCH_SIZE = int(os.environ.get('EMOTION_BATCH_SIZE', 16))  # Images or faces per inference batch
+EMOTION_BATCH_WAIT = float(os.environ.get('EMOTION_BATCH_WAIT', 0.01))  # Seconds to wait for a full batch
+EMOTION_MAX_IN_FLIGHT = int(os.environ.get('EMOTION_MAX_IN_FLIGHT', EMOTION_BATCH_SIZE))  # Uploads processed at once
+EMOTION_MAX_QUEUED = int(os.environ.get('EMOTION_MAX_QUEUED', EMOTION_BATCH_SIZE))  # Uploads waiting for a slot
+FACE_SCORE_THRESHOLD = float(os.environ.get('FACE_SCORE_THRESHOLD', 0.5))
+MAX_IMAGES_PER_REQUEST = int(os.environ.get('MAX_IMAGES_PER_REQUEST', 8))
+MAX_UPLOAD_LENGTH = int(os.environ.get('MAX_UPLOAD_LENGTH', 20 * 1024 * 1024))  # Bytes
 
 # Create models directory if it doesn't exist
 os.makedirs('models', exist_ok=True)
@@ -93,50 +164,251 @@ except:
     feature_names = None
     logger.warning("Feature names file not found.")
 
-# Text preprocessing function
-def preprocess_text(text):
-    """Clean and preprocess the input text."""
-    if not isinstance(text, str) or not text:
-        return ""
+# Load the online-learnable model and held-out set if available
+online_model = joblib.load(ONLINE_MODEL_PATH) if os.path.exists(ONLINE_MODEL_PATH) else None
+holdout = joblib.load(HOLDOUT_PATH) if os.path.exists(HOLDOUT_PATH) else None
+if online_model is None or holdout is None:
+    online_model = None
+    logger.warning("Online model or held-out set not found. Feedback updates are disabled; "
+                   "run train_model.py to enable them.")
+
+# Model bundles served side by side; the model above is always the 'default' bundle
+def file_digest(path):
+    """Return the SHA-256 digest of a file, used to share identical vectorizers."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+default_vectorizer_key = file_digest(VECTORIZER_PATH)
+
+# Snapshots of promoted online models, shared by every worker process
+def snapshot_versions():
+    """Return the snapshot directory names by version number."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return {}
+    return {int(name[1:]): name for name in os.listdir(SNAPSHOT_DIR) if name.startswith('v') and name[1:].isdigit()}
+
+def latest_snapshot():
+    """Return the path and metadata of the newest complete snapshot, or (None, None)."""
+    versions = snapshot_versions()
+    for version in sorted(versions, reverse=True):
+        snapshot_path = os.path.join(SNAPSHOT_DIR, versions[version])
+        metadata_path = os.path.join(snapshot_path, 'metadata.json')
+        # Snapshots are renamed into place once complete; older partial saves are skipped
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r') as f:
+                return snapshot_path, json.load(f)
+    return None, None
+
+# Resume serving the latest promoted online model if it was trained on the current features
+restored_snapshot = None
+snapshot_path, metadata = latest_snapshot()
+if metadata is not None:
+    if metadata.get('vectorizer') == default_vectorizer_key:
+        model = joblib.load(os.path.join(snapshot_path, 'model.pkl'))
+        if online_model is not None:
+            online_model = model
+        restored_snapshot = metadata
+        logger.info(f"Serving online model snapshot v{metadata['version']} "
+                    f"(held-out F1: {metadata['holdout_f1']:.4f})")
+    else:
+        logger.warning(f"Latest online model snapshot was trained with a different vectorizer; "
+                       f"serving {MODEL_PATH} instead.")
+
+vectorizers = {default_vectorizer_key: vectorizer}
+vectorizer_feature_names = {default_vectorizer_key: feature_names}
+model_bundles = {
+    'default': {'model': model, 'vectorizer': default_vectorizer_key}
+}
+serving_config = {'primary': 'default', 'shadow': [], 'split': {}}
+
+if os.path.exists(SERVING_CONFIG_PATH):
+    with open(SERVING_CONFIG_PATH, 'r') as f:
+        config = json.load(f)
     
-    # Convert to lowercase
-    text = text.lower()
+    for name, bundle_dir in config.get('bundles', {}).items():
+        bundle_model = joblib.load(os.path.join(bundle_dir, 'model.pkl'))
+        if not hasattr(bundle_model, 'predict_proba'):
+            logger.warning(f"Skipping model bundle {name}: model has no predict_proba")
+            continue
+        
+        # Bundles trained on the same vectorizer share one instance
+        vectorizer_path = os.path.join(bundle_dir, 'vectorizer.pkl')
+        key = file_digest(vectorizer_path)
+        if key not in vectorizers:
+            vectorizers[key] = joblib.load(vectorizer_path)
+            vectorizer_feature_names[key] = list(vectorizers[key].get_feature_names_out())
+        model_bundles[name] = {'model': bundle_model, 'vectorizer': key}
+    
+    serving_config['primary'] = config.get('primary', 'default')
+    serving_config['shadow'] = config.get('shadow', [])
+    serving_config['split'] = config.get('split', {})
+    
+    unknown = ({serving_config['primary']} | set(serving_config['shadow']) | set(serving_config['split'])) - set(model_bundles)
+    if unknown:
+        raise ValueError(f"Serving config refers to unknown model bundles: {', '.join(sorted(unknown))}")
+    if sum(serving_config['split'].values()) > 100:
+        raise ValueError("Serving config split percentages add up to more than 100")
+    
+    logger.info(f"Loaded {len(model_bundles)} model bundles with {len(vectorizers)} distinct vectorizers "
+                f"(primary: {serving_config['primary']}, shadow: {serving_config['shadow']}, "
+                f"split: {serving_config['split']})")
+    if serving_config['primary'] != 'default':
+        logger.warning("Online feedback updates only apply to the 'default' bundle, "
+                       f"not to the primary bundle {serving_config['primary']}")
+
+model_stats = {
+    name: {
+        'served': 0,
+        'shadowed': 0,
+        'latencies': deque(maxlen=1000),  # Recent predict_proba times in seconds
+        'compared': 0,
+        'disagreements': 0,
+        'probability_diff_sum': 0.0
+    }
+    for name in model_bundles
+}
+model_stats_lock = threading.Lock()
+
+# Stopwords and lemmatizer are loaded once and shared by every request
+stop_words = set(stopwords.words('english'))
+lemmatizer = WordNetLemmatizer()
+
+@lru_cache(maxsize=100000)
+def lemmatize_word(word):
+    """Lemmatize a single word, caching results across requests."""
+    return lemmatizer.lemmatize(word)
+
+# Text preprocessing functions
+def split_sentences(text):
+    """Remove URLs and HTML tags from the whole text and split it into sentences."""
+    if not isinstance(text, str) or not text:
+        return []
     
     # Remove URLs
-    text = re.sub(r'https?://\S+|www\.\S+', '', text)
+    text = re.sub(r'https?://\S+|www\.\S+', '', text, flags=re.IGNORECASE)
     
     # Remove HTML tags
     text = re.sub(r'<.*?>', '', text)
     
+    return sent_tokenize(text)
+
+def tokenize_sentence(sentence):
+    """Clean one sentence and return its lemmatized tokens."""
+    # Convert to lowercase
+    sentence = sentence.lower()
+    
     # Remove special characters and numbers (keep punctuation for now)
-    text = re.sub(r'[^a-zA-Z\s.,!?]', '', text)
+    sentence = re.sub(r'[^a-zA-Z\s.,!?]', '', sentence)
     
     # Tokenize
-    tokens = word_tokenize(text)
+    tokens = word_tokenize(sentence, preserve_line=True)
     
     # Remove stopwords
-    stop_words = set(stopwords.words('english'))
     tokens = [word for word in tokens if word not in stop_words]
     
     # Lemmatization
-    lemmatizer = WordNetLemmatizer()
-    tokens = [lemmatizer.lemmatize(word) for word in tokens]
+    tokens = [lemmatize_word(word) for word in tokens]
     
+    return tokens
+
+def tokenize_text(text):
+    """Clean the input text and return its lemmatized tokens.
+    
+    The tokens are exactly the concatenated tokens of its sentences, so an
+    article scores the same whether or not its sentences are scored too.
+    """
+    return [token for sentence in split_sentences(text) for token in tokenize_sentence(sentence)]
+
+def preprocess_text(text):
+    """Clean and preprocess the input text."""
     # Join tokens back into text
-    processed_text = ' '.join(tokens)
+    return ' '.join(tokenize_text(text))
+
+def supports_fused_vectorizing(vec):
+    """Check whether a fitted vectorizer can be applied directly to tokens."""
+    return (
+        isinstance(vec, CountVectorizer)
+        and vec.analyzer == 'word'
+        and vec.preprocessor is None
+        and vec.tokenizer is None
+        and vec.strip_accents is None
+        and hasattr(vec, 'vocabulary_')
+    )
+
+def vectorize_tokens(token_lists, vec=None):
+    """Build the vectorizer's sparse matrix directly from lemmatized tokens.
+    
+    Produces exactly the same matrix as ``vec.transform`` on the joined
+    tokens, but skips rebuilding the string and tokenizing it a second time.
+    """
+    vec = vectorizer if vec is None else vec
+    if not supports_fused_vectorizing(vec):
+        return vec.transform([' '.join(tokens) for tokens in token_lists])
+    
+    token_pattern = re.compile(vec.token_pattern)
+    vec_stop_words = vec.get_stop_words()
+    min_n, max_n = vec.ngram_range
+    vocabulary = vec.vocabulary_
+    
+    indices = []
+    values = []
+    indptr = [0]
+    for tokens in token_lists:
+        # Tokens never contain spaces, so matching each one separately gives
+        # the same terms as matching the joined string
+        terms = [term for token in tokens for term in token_pattern.findall(token)]
+        if vec_stop_words is not None:
+            terms = [term for term in terms if term not in vec_stop_words]
+        
+        # Count the n-grams that are in the vocabulary
+        counts = {}
+        for n in range(min_n, min(max_n, len(terms)) + 1):
+            for i in range(len(terms) - n + 1):
+                idx = vocabulary.get(terms[i] if n == 1 else ' '.join(terms[i:i + n]))
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+        
+        indices.extend(counts.keys())
+        values.extend(counts.values())
+        indptr.append(len(indices))
     
-    return processed_text
+    X = sparse.csr_matrix(
+        (np.array(values, dtype=vec.dtype), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int32)),
+        shape=(len(token_lists), len(vocabulary))
+    )
+    X.sort_indices()
+    
+    if vec.binary:
+        X.data.fill(1)
+    
+    # Apply the same weighting as TfidfTransformer
+    if isinstance(vec, TfidfVectorizer):
+        if X.dtype not in (np.float32, np.float64):
+            X = X.astype(np.float64)
+        if vec.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1.0
+        if vec.use_idf:
+            X.data *= vec.idf_[X.indices]
+        if vec.norm is not None:
+            X = normalize(X, norm=vec.norm, copy=False)
+    
+    return X
 
 # Extract additional features from text
-def extract_additional_features(text):
-    """Extract linguistic and stylistic features from text."""
+def extract_additional_features(text, sentences=None):
+    """Extract linguistic and stylistic features from text.
+    
+    Pass ``sentences`` to reuse an existing ``split_sentences`` result.
+    """
     features = {}
     
     # Original text length
     features['text_length'] = len(text)
     
     # Count sentences
-    sentences = sent_tokenize(text)
+    if sentences is None:
+        sentences = split_sentences(text)
     features['sentence_count'] = len(sentences)
     
     # Average sentence length
@@ -200,15 +472,33 @@ def extract_additional_features(text):
     
     return features
 
-# Get feature importance
-def get_feature_importance(text, prediction_proba):
-    """Extract feature importance for the prediction."""
-    # Process the text
-    processed_text = preprocess_text(text)
-    
-    # Transform text using the vectorizer
-    text_vector = vectorizer.transform([processed_text])
+def linear_coefficients(model):
+    """Return a linear model's coefficients, averaged over calibrated copies, or None."""
+    if hasattr(model, 'coef_'):
+        return model.coef_[0]
     
+    # CalibratedClassifierCV keeps one fitted estimator per calibration fold
+    # (named base_estimator before scikit-learn 1.2)
+    estimators = [
+        getattr(calibrated, 'estimator', getattr(calibrated, 'base_estimator', None))
+        for calibrated in getattr(model, 'calibrated_classifiers_', [])
+    ]
+    if estimators and all(hasattr(estimator, 'coef_') for estimator in estimators):
+        return np.mean([estimator.coef_[0] for estimator in estimators], axis=0)
+    return None
+
+def is_explainable(model):
+    """Check whether get_feature_importance can explain a model's predictions."""
+    return hasattr(model, 'feature_importances_') or linear_coefficients(model) is not None
+
+for name, bundle in model_bundles.items():
+    if not is_explainable(bundle['model']):
+        logger.warning(f"Model bundle {name} ({type(bundle['model']).__name__}) has no coefficients or "
+                       f"feature importances; its 'features' output will be empty")
+
+# Get feature importance
+def get_feature_importance(text_vector, model, feature_names):
+    """Extract feature importance for the prediction of a vectorized article."""
     # Get feature importance if possible
     feature_importance = {}
     
@@ -226,9 +516,9 @@ def get_feature_importance(text, prediction_proba):
                 importance = importances[idx] if idx < len(importances) else 0
                 feature_importance[feature_name] = float(importance)
     
-    elif hasattr(model, 'coef_') and feature_names:
+    elif linear_coefficients(model) is not None and feature_names:
         # For linear models
-        coefs = model.coef_[0]
+        coefs = linear_coefficients(model)
         
         # Get non-zero elements from the sparse matrix
         non_zero_indices = text_vector.nonzero()[1]
@@ -251,7 +541,254 @@ def get_feature_importance(text, prediction_proba):
     
     return dict(sorted_importance)
 
+def format_additional_features(additional_features):
+    """Convert feature values to JSON-friendly floats."""
+    return {k: float(v) if isinstance(v, (int, float, np.number)) else v 
+            for k, v in additional_features.items()}
+
+def choose_model(requested=None):
+    """Pick the bundle that serves a request, following the configured traffic split."""
+    if requested is not None:
+        return requested if isinstance(requested, str) and requested in model_bundles else None
+    
+    draw = random.uniform(0, 100)
+    cumulative = 0
+    for name, percentage in serving_config['split'].items():
+        cumulative += percentage
+        if draw < cumulative:
+            return name
+    return serving_config['primary']
+
+def vectorize_for_models(batch, served, names):
+    """Vectorize a token batch once per distinct vectorizer used by the given bundles.
+    
+    Only the served bundle's vectorizer sees the whole batch; shadows score the
+    article row alone.
+    """
+    served_key = model_bundles[served]['vectorizer']
+    matrices = {served_key: vectorize_tokens(batch, vectorizers[served_key])}
+    for name in names:
+        key = model_bundles[name]['vectorizer']
+        if key not in matrices:
+            matrices[key] = vectorize_tokens(batch[:1], vectorizers[key])
+    return matrices
+
+def predict_for_models(matrices, served, names):
+    """Score every bundle from the shared matrices and record latency and disagreement."""
+    probas = {}
+    latencies = {}
+    for name in names:
+        X = matrices[model_bundles[name]['vectorizer']]
+        bundle_model = model_bundles[name]['model']
+        
+        # Time the article row alone so latencies compare across bundles
+        start = time.perf_counter()
+        probas[name] = bundle_model.predict_proba(X[:1])
+        latencies[name] = time.perf_counter() - start
+        
+        # The served bundle also scores the sentence rows
+        if name == served and X.shape[0] > 1:
+            probas[name] = np.vstack([probas[name], bundle_model.predict_proba(X[1:])])
+    
+    served_proba = probas[served][0][1]
+    with model_stats_lock:
+        for name in names:
+            stats = model_stats[name]
+            stats['latencies'].append(latencies[name])
+            if name == served:
+                stats['served'] += 1
+                continue
+            shadow_proba = probas[name][0][1]
+            stats['shadowed'] += 1
+            stats['compared'] += 1
+            stats['disagreements'] += int((shadow_proba > 0.5) != (served_proba > 0.5))
+            stats['probability_diff_sum'] += float(abs(shadow_proba - served_proba))
+    
+    return probas
+
+# Recent scoring results, so explanations can be computed without re-scoring
+analysis_cache = OrderedDict()
+analysis_cache_lock = threading.Lock()
+analysis_cache_bytes = 0
+
+def analysis_size(entry):
+    """Estimate the memory held by a cached scoring result in bytes."""
+    vector = entry['vector']
+    return (sys.getsizeof(entry['text']) + vector.data.nbytes + vector.indices.nbytes
+            + vector.indptr.nbytes + 1024)  # Allowance for the dicts and small objects
+
+def analysis_id_for(text, model_name):
+    """Return the cache key of an article's scoring result from one model bundle."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()[:32]
+
+def cache_analysis(analysis_id, entry):
+    """Store a scoring result, evicting the least recently used ones to stay within the byte budget."""
+    global analysis_cache_bytes
+    
+    entry['size'] = analysis_size(entry)
+    if entry['size'] > ANALYSIS_CACHE_BYTES:
+        return
+    
+    with analysis_cache_lock:
+        previous = analysis_cache.pop(analysis_id, None)
+        if previous is not None:
+            analysis_cache_bytes -= previous['size']
+        analysis_cache[analysis_id] = entry
+        analysis_cache_bytes += entry['size']
+        while analysis_cache_bytes > ANALYSIS_CACHE_BYTES:
+            _, evicted = analysis_cache.popitem(last=False)
+            analysis_cache_bytes -= evicted['size']
+
+def get_cached_analysis(analysis_id):
+    """Return a cached scoring result, or None if it is not cached."""
+    with analysis_cache_lock:
+        entry = analysis_cache.get(analysis_id)
+        if entry is not None:
+            analysis_cache.move_to_end(analysis_id)
+        return entry
+
+def parse_outputs(data):
+    """Return the requested optional outputs, or None if any are unknown."""
+    outputs = data.get('outputs', list(ANALYZE_OUTPUTS))
+    if not isinstance(outputs, list) or not set(outputs) <= set(ANALYZE_OUTPUTS):
+        return None
+    return set(outputs)
+
+# Admission control and backpressure. Text and image requests have separate
+# slots, so a burst of slow uploads cannot starve text analysis.
+admission_pools = {
+    'analysis': {'max_in_flight': MAX_IN_FLIGHT, 'max_queued': MAX_QUEUED},
+    'emotion': {'max_in_flight': EMOTION_MAX_IN_FLIGHT, 'max_queued': EMOTION_MAX_QUEUED}
+}
+admission_slots = {name: threading.Semaphore(pool['max_in_flight']) for name, pool in admission_pools.items()}
+admission_lock = threading.Lock()
+admission_stats = {
+    'pools': {name: {'in_flight': 0, 'queued': 0, 'admitted': 0} for name in admission_pools},
+    'skipped_outputs': 0,
+    'rejected': {
+        'rate_limited': 0,
+        'queue_full': 0,
+        'queue_timeout': 0,
+        'deadline_exceeded': 0,
+        'too_large': 0
+    }
+}
+client_buckets = {}  # client -> (tokens, last refill time)
+worker_started = datetime.now().isoformat()
+
+def worker_identity():
+    """Identify this worker process; counters are per process and must be summed across workers."""
+    return {'pid': os.getpid(), 'worker_started': worker_started}
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has too little time left to start a stage."""
+
+def check_deadline(stage):
+    """Raise DeadlineExceeded unless the current request has time left to start a stage."""
+    remaining = g.request_deadline - time.monotonic()
+    if remaining < STAGE_BUDGETS[stage]:
+        raise DeadlineExceeded(f"{max(remaining, 0):.2f}s left of the request deadline, "
+                               f"the {stage} stage needs {STAGE_BUDGETS[stage]:.2f}s")
+
+def can_start(stage):
+    """Return whether an optional stage has time left to start, counting it as skipped otherwise."""
+    if g.request_deadline - time.monotonic() >= STAGE_BUDGETS[stage]:
+        return True
+    with admission_lock:
+        admission_stats['skipped_outputs'] += 1
+    return False
+
+def take_token(client):
+    """Take a token from the client's bucket and return the seconds to wait if it is empty."""
+    refill_rate = RATE_LIMIT_PER_MINUTE / 60.0
+    now = time.monotonic()
+    
+    with admission_lock:
+        tokens, last = client_buckets.get(client, (RATE_LIMIT_BURST, now))
+        tokens = min(RATE_LIMIT_BURST, tokens + (now - last) * refill_rate)
+        
+        if tokens < 1:
+            client_buckets[client] = (tokens, now)
+            return (1 - tokens) / refill_rate
+        
+        client_buckets[client] = (tokens - 1, now)
+        
+        # Forget clients whose buckets have refilled completely
+        if len(client_buckets) > 10000:
+            full_after = RATE_LIMIT_BURST / refill_rate
+            for key, (_, seen) in list(client_buckets.items()):
+                if now - seen > full_after:
+                    del client_buckets[key]
+    
+    return 0
+
+def reject(reason, status_code, message, retry_after=None):
+    """Build a rejection response and count it."""
+    with admission_lock:
+        admission_stats['rejected'][reason] += 1
+    
+    response = jsonify({'error': message})
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def admission_controlled(max_content_length=MAX_CONTENT_LENGTH, deadline=REQUEST_DEADLINE, pool='analysis'):
+    """Limit a view by client rate, request size and in-flight requests, and give it a deadline."""
+    def decorator(view):
+        return admitted_view(view, max_content_length, deadline, pool)
+    return decorator
+
+def admitted_view(view, max_content_length, deadline, pool):
+    """Wrap a view with admission control from one admission pool."""
+    slots = admission_slots[pool]
+    max_queued = admission_pools[pool]['max_queued']
+    pool_stats = admission_stats['pools'][pool]
+    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        arrived = time.monotonic()
+        if request.content_length is not None and request.content_length > max_content_length:
+            return reject('too_large', 413, f"Request body exceeds {max_content_length} bytes")
+        
+        retry_after = take_token(request.remote_addr or 'unknown')
+        if retry_after:
+            return reject('rate_limited', 429, 'Rate limit exceeded', retry_after)
+        
+        # Take a free slot immediately, otherwise wait in the bounded queue
+        acquired = slots.acquire(blocking=False)
+        if not acquired:
+            with admission_lock:
+                if pool_stats['queued'] >= max_queued:
+                    queue_full = True
+                else:
+                    queue_full = False
+                    pool_stats['queued'] += 1
+            if queue_full:
+                return reject('queue_full', 503, 'Server is overloaded, try again later', QUEUE_TIMEOUT)
+            
+            acquired = slots.acquire(timeout=min(QUEUE_TIMEOUT, deadline))
+            with admission_lock:
+                pool_stats['queued'] -= 1
+            if not acquired:
+                return reject('queue_timeout', 503, 'Server is overloaded, try again later', QUEUE_TIMEOUT)
+        
+        # The deadline counts from arrival, so time spent queued uses up the budget
+        g.request_deadline = arrived + deadline
+        with admission_lock:
+            pool_stats['in_flight'] += 1
+            pool_stats['admitted'] += 1
+        try:
+            return view(*args, **kwargs)
+        finally:
+            with admission_lock:
+                pool_stats['in_flight'] -= 1
+            slots.release()
+    
+    return wrapper
+
 @app.route('/api/analyze', methods=['POST'])
+@admission_controlled()
 def analyze_article():
     """API endpoint to analyze a news article."""
     try:
@@ -261,49 +798,691 @@ def analyze_article():
             return jsonify({'error': 'No text provided'}), 400
         
         text = data['text']
+        include_sentences = bool(data.get('sentences', False))
+        outputs = parse_outputs(data)
+        
+        if not isinstance(text, str):
+            return jsonify({'error': 'Text must be a string'}), 400
+        if len(text) > MAX_TEXT_LENGTH:
+            return reject('too_large', 413, f"Text exceeds {MAX_TEXT_LENGTH} characters")
+        if outputs is None:
+            return jsonify({'error': f"Outputs must be a list of {', '.join(ANALYZE_OUTPUTS)}"}), 400
+        
+        served = choose_model(data.get('model'))
+        if served is None:
+            return jsonify({'error': f"Unknown model, choose one of {', '.join(model_bundles)}"}), 400
+        names = [served] + [name for name in serving_config['shadow'] if name != served]
         
         # Log the request (excluding the full text for privacy)
         logger.info(f"Received analysis request: {len(text)} characters")
+        bundle = model_bundles[served]
+        
+        # Optional stages are skipped when the request is running out of time
+        skipped = []
+        if include_sentences and not can_start('sentences'):
+            include_sentences = False
+            skipped.append('sentences')
         
         # Preprocess the text
-        processed_text = preprocess_text(text)
+        check_deadline('preprocess')
+        sentences = split_sentences(text)
         
-        # Transform text using the vectorizer
-        text_vector = vectorizer.transform([processed_text])
+        # Score every sentence in the same batch as the article; the article row
+        # is the concatenation of the sentence rows, as tokenize_text builds it
+        sentence_tokens = [tokenize_sentence(sentence) for sentence in sentences]
+        batch = [[token for tokens in sentence_tokens for token in tokens]]
+        if include_sentences:
+            batch.extend(sentence_tokens)
         
-        # Extract additional features
-        additional_features = extract_additional_features(text)
+        # Map tokens straight to the features of every vectorizer in use
+        check_deadline('vectorize')
+        matrices = vectorize_for_models(batch, served, names)
+        text_vectors = matrices[bundle['vectorizer']]
         
-        # Make prediction
-        prediction_proba = model.predict_proba(text_vector)[0]
+        # Make prediction, scoring shadow models from the same matrices
+        check_deadline('predict')
+        batch_proba = predict_for_models(matrices, served, names)[served]
+        prediction_proba = batch_proba[0]
         fake_probability = prediction_proba[1]  # Assuming 1 is the fake class
         prediction = "fake" if fake_probability > 0.5 else "real"
         
-        # Get feature importance
-        feature_importance = get_feature_importance(text, prediction_proba)
-        
         # Calculate confidence (distance from 0.5)
         confidence = abs(fake_probability - 0.5) * 2
         
         # Prepare response
+        analysis_id = analysis_id_for(text, served)
         response = {
+            'analysis_id': analysis_id,
+            'model': served,
             'prediction': prediction,
             'confidence': float(confidence),
-            'probability': float(fake_probability),
-            'features': feature_importance,
-            'additional_features': {k: float(v) if isinstance(v, (int, float, np.number)) else v 
-                                   for k, v in additional_features.items()}
+            'probability': float(fake_probability)
         }
         
+        # Keep the scoring result so /api/explain can reuse it
+        cache_analysis(analysis_id, {
+            'text': text,
+            'vector': text_vectors[0],
+            'model': bundle['model'],
+            'feature_names': vectorizer_feature_names[bundle['vectorizer']],
+            'response': dict(response)
+        })
+        
+        # Only compute the explanations that were requested and have time left
+        if 'features' in outputs:
+            if can_start('explain'):
+                response['features'] = get_feature_importance(
+                    text_vectors[0], bundle['model'], vectorizer_feature_names[bundle['vectorizer']]
+                )
+            else:
+                skipped.append('features')
+        if 'additional_features' in outputs:
+            if can_start('explain'):
+                response['additional_features'] = format_additional_features(
+                    extract_additional_features(text, sentences)
+                )
+            else:
+                skipped.append('additional_features')
+        
+        if include_sentences:
+            response['sentences'] = [
+                {'index': i, 'text': sentence, 'probability': float(proba)}
+                for i, (sentence, proba) in enumerate(zip(sentences, batch_proba[1:, 1]))
+            ]
+        if skipped:
+            response['skipped'] = skipped
+        
         # Log the result
         logger.info(f"Analysis result: {prediction} with {confidence:.2f} confidence")
         
         return jsonify(response)
         
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in analyze_article: {str(e)}")
+        return reject('deadline_exceeded', 503, str(e), QUEUE_TIMEOUT)
+    
     except Exception as e:
         logger.error(f"Error in analyze_article: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/explain', methods=['POST'])
+@admission_controlled()
+def explain_article():
+    """API endpoint to explain a previously scored article."""
+    try:
+        data = request.json
+        
+        if not data or not (data.get('analysis_id') or data.get('text')):
+            return jsonify({'error': 'No analysis_id or text provided'}), 400
+        
+        outputs = parse_outputs(data)
+        if outputs is None:
+            return jsonify({'error': f"Outputs must be a list of {', '.join(ANALYZE_OUTPUTS)}"}), 400
+        
+        text = data.get('text')
+        if text is not None and not isinstance(text, str):
+            return jsonify({'error': 'Text must be a string'}), 400
+        if text is not None and len(text) > MAX_TEXT_LENGTH:
+            return reject('too_large', 413, f"Text exceeds {MAX_TEXT_LENGTH} characters")
+        
+        requested = data.get('model')
+        if requested is not None and (not isinstance(requested, str) or requested not in model_bundles):
+            return jsonify({'error': f"Unknown model, choose one of {', '.join(model_bundles)}"}), 400
+        
+        analysis_id = data.get('analysis_id') or analysis_id_for(text, requested or serving_config['primary'])
+        entry = get_cached_analysis(analysis_id)
+        cached = entry is not None
+        
+        # Score the article first if its result is no longer cached, with the
+        # bundle whose analysis_id matches
+        if not cached:
+            if text is None:
+                return jsonify({'error': 'Analysis not found, send the text instead'}), 404
+            served = next((name for name in model_bundles if analysis_id_for(text, name) == analysis_id), None)
+            if served is None:
+                return jsonify({'error': 'analysis_id does not match the text'}), 400
+            check_deadline('preprocess')
+            bundle = model_bundles[served]
+            text_vector = vectorize_tokens([tokenize_text(text)], vectorizers[bundle['vectorizer']])
+            fake_probability = bundle['model'].predict_proba(text_vector)[0][1]
+            entry = {
+                'text': text,
+                'vector': text_vector,
+                'model': bundle['model'],
+                'feature_names': vectorizer_feature_names[bundle['vectorizer']],
+                'response': {
+                    'analysis_id': analysis_id,
+                    'model': served,
+                    'prediction': "fake" if fake_probability > 0.5 else "real",
+                    'confidence': float(abs(fake_probability - 0.5) * 2),
+                    'probability': float(fake_probability)
+                }
+            }
+            cache_analysis(analysis_id, entry)
+        
+        logger.info(f"Received explanation request for analysis {analysis_id}")
+        
+        check_deadline('explain')
+        response = dict(entry['response'])
+        response['cached'] = cached
+        if 'features' in outputs:
+            response['features'] = get_feature_importance(entry['vector'], entry['model'], entry['feature_names'])
+        if 'additional_features' in outputs:
+            response['additional_features'] = format_additional_features(
+                extract_additional_features(entry['text'])
+            )
+        
+        return jsonify(response)
+        
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in explain_article: {str(e)}")
+        return reject('deadline_exceeded', 503, str(e), QUEUE_TIMEOUT)
+    
+    except Exception as e:
+        logger.error(f"Error in explain_article: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# Online learning from labeled feedback. Any worker can accept feedback into
+# the spool directory, one elected learner process applies it, and every
+# worker serves the latest promoted snapshot.
+online_state = {
+    'version': restored_snapshot['version'] if restored_snapshot else 0,
+    'samples_seen': restored_snapshot['samples_seen'] if restored_snapshot else 0,
+    'batches_applied': 0,
+    'promotions': 0,
+    'rejections': 0,
+    'served_f1': restored_snapshot['holdout_f1'] if restored_snapshot else None,
+    'best_f1': restored_snapshot.get('best_f1', restored_snapshot['holdout_f1']) if restored_snapshot else None,
+    'last_update': restored_snapshot['timestamp'] if restored_snapshot else None
+}
+online_state_lock = threading.Lock()
+holdout_vectors = None  # Held-out set vectorized once by the learner
+
+def parse_label(label):
+    """Convert a feedback label to 0 (real) or 1 (fake), or None if invalid."""
+    if isinstance(label, str):
+        return {'real': 0, 'fake': 1, '0': 0, '1': 1}.get(label.strip().lower())
+    if isinstance(label, (bool, int)) and int(label) in (0, 1):
+        return int(label)
+    return None
+
+def pending_feedback():
+    """Return the spooled feedback files, oldest first, with their item counts."""
+    if not os.path.isdir(FEEDBACK_DIR):
+        return []
+    return sorted(
+        (name, int(name[:-len('.json')].rsplit('-', 1)[1]))
+        for name in os.listdir(FEEDBACK_DIR) if name.endswith('.json') and name != 'status.json'
+    )
+
+def pending_feedback_count():
+    """Return the number of feedback items waiting for the learner."""
+    return sum(count for _, count in pending_feedback())
+
+def write_atomically(path, write):
+    """Write a file through a temporary file and rename it into place."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+def spool_feedback(items):
+    """Hand labeled articles to the learner process through the spool directory."""
+    name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}-{len(items)}.json"
+    write_atomically(os.path.join(FEEDBACK_DIR, name), lambda f: json.dump(items, f))
+
+def evaluate_on_holdout(candidate_model):
+    """Return the F1 score of a model on the held-out set."""
+    return f1_score(holdout['label'], candidate_model.predict(holdout_vectors))
+
+def save_snapshot(candidate_model, holdout_f1):
+    """Save a versioned snapshot of a promoted online model.
+    
+    The snapshot is written to a temporary directory and renamed into place,
+    so readers never see a partial snapshot.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    temp_path = tempfile.mkdtemp(prefix='.tmp-', dir=SNAPSHOT_DIR)
+    joblib.dump(candidate_model, os.path.join(temp_path, 'model.pkl'))
+    
+    while True:
+        version = max(snapshot_versions(), default=0) + 1
+        with open(os.path.join(temp_path, 'metadata.json'), 'w') as f:
+            json.dump({
+                'version': version,
+                'timestamp': datetime.now().isoformat(),
+                'samples_seen': online_state['samples_seen'],
+                'holdout_f1': holdout_f1,
+                'best_f1': online_state['best_f1'],
+                'vectorizer': default_vectorizer_key
+            }, f, indent=2)
+        try:
+            os.rename(temp_path, os.path.join(SNAPSHOT_DIR, f"v{version:04d}"))
+            break
+        except OSError:
+            # Another process took this version first; try the next one
+            if not os.path.exists(os.path.join(SNAPSHOT_DIR, f"v{version:04d}")):
+                raise
+    
+    # Keep the latest learner state so restarts resume from it
+    fd, temp_model_path = tempfile.mkstemp(dir='models', suffix='.tmp')
+    os.close(fd)
+    joblib.dump(candidate_model, temp_model_path)
+    os.replace(temp_model_path, ONLINE_MODEL_PATH)
+    
+    return version
+
+def reload_latest_snapshot():
+    """Serve the latest snapshot if another process promoted a newer one."""
+    global model, online_model
+    
+    snapshot_path, metadata = latest_snapshot()
+    if metadata is None or metadata['version'] <= online_state['version']:
+        return
+    if metadata.get('vectorizer') != default_vectorizer_key:
+        return
+    
+    promoted = joblib.load(os.path.join(snapshot_path, 'model.pkl'))
+    model = promoted
+    model_bundles['default']['model'] = promoted
+    online_model = promoted
+    with online_state_lock:
+        online_state['version'] = metadata['version']
+        online_state['samples_seen'] = metadata['samples_seen']
+        online_state['served_f1'] = metadata['holdout_f1']
+        online_state['best_f1'] = metadata.get('best_f1', metadata['holdout_f1'])
+        online_state['last_update'] = metadata['timestamp']
+    logger.info(f"Reloaded online model snapshot v{metadata['version']}")
+
+def apply_feedback_batch(batch):
+    """Update the online model with a batch of labeled articles.
+    
+    The update is applied to a copy, so requests keep using the current model
+    until the copy passes the held-out check and replaces it. A rejected update
+    is discarded and the next batch starts again from the current model.
+    """
+    global model, online_model
+    
+    texts = [preprocess_text(text) for text, _ in batch]
+    labels = np.array([label for _, label in batch])
+    
+    candidate = copy.deepcopy(online_model)
+    candidate.partial_fit(vectorizer.transform(texts), labels, classes=np.array([0, 1]))
+    
+    with online_state_lock:
+        online_state['samples_seen'] += len(batch)
+        online_state['batches_applied'] += 1
+        online_state['last_update'] = datetime.now().isoformat()
+    
+    # Compare against the best held-out F1 so far, so small drops cannot add up
+    if online_state['best_f1'] is None:
+        served_f1 = evaluate_on_holdout(model)
+        with online_state_lock:
+            online_state['served_f1'] = served_f1
+            online_state['best_f1'] = served_f1
+    
+    candidate_f1 = evaluate_on_holdout(candidate)
+    if candidate_f1 >= online_state['best_f1'] - FEEDBACK_F1_TOLERANCE:
+        with online_state_lock:
+            online_state['served_f1'] = candidate_f1
+            online_state['best_f1'] = max(online_state['best_f1'], candidate_f1)
+        version = save_snapshot(candidate, candidate_f1)
+        online_model = candidate
+        model = candidate
+        model_bundles['default']['model'] = candidate
+        with online_state_lock:
+            online_state['version'] = version
+            online_state['promotions'] += 1
+        logger.info(f"Promoted online model v{version} (held-out F1: {candidate_f1:.4f})")
+    else:
+        with online_state_lock:
+            online_state['rejections'] += 1
+        logger.info(f"Online model update rejected (held-out F1: {candidate_f1:.4f}, "
+                    f"best: {online_state['best_f1']:.4f})")
+
+def write_learner_status():
+    """Publish the learner's state so every worker can report it."""
+    with online_state_lock:
+        status = dict(online_state, learner_pid=os.getpid())
+    write_atomically(os.path.join(FEEDBACK_DIR, 'status.json'), lambda f: json.dump(status, f))
+
+def feedback_learner():
+    """Wait to become the single learner process, then apply spooled feedback in batches."""
+    global holdout_vectors
+    
+    # The lock is released when the process exits, so another worker takes over
+    lock_file = open(os.path.join(FEEDBACK_DIR, 'learner.lock'), 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    
+    reload_latest_snapshot()
+    holdout_vectors = vectorizer.transform(holdout['text'])
+    write_learner_status()
+    logger.info(f"Process {os.getpid()} is applying online feedback")
+    
+    while True:
+        # Collect spooled files until the batch is full or the oldest has waited long enough
+        batch_deadline = None
+        while True:
+            files = pending_feedback()
+            if sum(count for _, count in files) >= FEEDBACK_BATCH_SIZE:
+                break
+            if files and batch_deadline is None:
+                batch_deadline = time.monotonic() + FEEDBACK_BATCH_WAIT
+            if batch_deadline is not None and time.monotonic() >= batch_deadline:
+                break
+            time.sleep(FEEDBACK_POLL_INTERVAL)
+        
+        taken = []
+        batch = []
+        for name, _ in files:
+            with open(os.path.join(FEEDBACK_DIR, name), 'r') as f:
+                batch.extend((text, label) for text, label in json.load(f))
+            taken.append(name)
+            if len(batch) >= FEEDBACK_BATCH_SIZE:
+                break
+        
+        try:
+            apply_feedback_batch(batch)
+        except Exception as e:
+            logger.error(f"Error in feedback_learner: {str(e)}", exc_info=True)
+        
+        for name in taken:
+            os.remove(os.path.join(FEEDBACK_DIR, name))
+        write_learner_status()
+
+def snapshot_watcher():
+    """Background worker that serves snapshots promoted by the learner process."""
+    while True:
+        time.sleep(SNAPSHOT_POLL_INTERVAL)
+        try:
+            reload_latest_snapshot()
+        except Exception as e:
+            logger.error(f"Error in snapshot_watcher: {str(e)}", exc_info=True)
+
+@app.route('/api/feedback', methods=['POST'])
+@admission_controlled()
+def submit_feedback():
+    """API endpoint to queue labeled articles for online model updates."""
+    try:
+        if online_model is None:
+            return jsonify({'error': 'Online learning is not available'}), 503
+        
+        data = request.json
+        if not data or not isinstance(data, dict):
+            return jsonify({'error': 'No feedback provided'}), 400
+        
+        # Accept a single article or a list of articles
+        items = data.get('items', [data])
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Items must be a non-empty list'}), 400
+        
+        parsed = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('text'), str) or not item['text']:
+                return jsonify({'error': 'Each feedback item needs a text string'}), 400
+            if len(item['text']) > MAX_TEXT_LENGTH:
+                return reject('too_large', 413, f"Text exceeds {MAX_TEXT_LENGTH} characters")
+            label = parse_label(item.get('label'))
+            if label is None:
+                return jsonify({'error': 'Label must be "fake", "real", 1 or 0'}), 400
+            parsed.append((item['text'], label))
+        
+        if pending_feedback_count() + len(parsed) > FEEDBACK_QUEUE_SIZE:
+            return jsonify({'error': 'Feedback queue is full, try again later'}), 503
+        spool_feedback(parsed)
+        
+        logger.info(f"Queued {len(parsed)} feedback items")
+        
+        return jsonify({'queued': len(parsed), 'queue_size': pending_feedback_count()}), 202
+    
+    except Exception as e:
+        logger.error(f"Error in submit_feedback: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/feedback/status', methods=['GET'])
+def feedback_status():
+    """Report the state of online learning, as published by the learner process."""
+    status_path = os.path.join(FEEDBACK_DIR, 'status.json')
+    if os.path.exists(status_path):
+        with open(status_path, 'r') as f:
+            status = json.load(f)
+    else:
+        with online_state_lock:
+            status = dict(online_state, learner_pid=None)
+    status['enabled'] = online_model is not None
+    status['bundle'] = 'default'
+    status['serving_version'] = online_state['version']
+    status['pid'] = os.getpid()
+    status['queue_size'] = pending_feedback_count()
+    return jsonify(status)
+
+if online_model is not None:
+    os.makedirs(FEEDBACK_DIR, exist_ok=True)
+    threading.Thread(target=feedback_learner, name='feedback-learner', daemon=True).start()
+    threading.Thread(target=snapshot_watcher, name='snapshot-watcher', daemon=True).start()
+
+# Server-side emotion detection
+class MicroBatcher:
+    """Collect inputs from concurrent requests and run them through a model in batches."""
+    
+    def __init__(self, name, predict, max_batch_size, max_wait):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        threading.Thread(target=self.run, name=name, daemon=True).start()
+    
+    def submit(self, item):
+        """Queue one input and return a future for its output."""
+        future = Future()
+        self.queue.put((item, future))
+        return future
+    
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            
+            # Collect more items until the batch is full or the wait expires
+            batch_deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = batch_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Drop inputs whose requests stopped waiting for them
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            
+            try:
+                outputs = self.predict(np.stack([item for item, _ in batch]))
+                for (_, future), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+def wait_for_stage(futures, stage):
+    """Wait for a stage's futures until the request deadline, cancelling the rest when it passes."""
+    try:
+        return [future.result(timeout=max(g.request_deadline - time.monotonic(), 0)) for future in futures]
+    except FutureTimeoutError:
+        for future in futures:
+            future.cancel()
+        raise DeadlineExceeded(f"Request deadline passed during the {stage} stage")
+
+# Load the face detector and expression classifier if their weights are available
+try:
+    face_detector, expression_classifier = emotion_model.load_models(EMOTION_MODELS_DIR)
+    decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='image-decode')
+    detection_batcher = MicroBatcher(
+        'face-detection',
+        lambda batch: face_detector.detect(batch, score_threshold=FACE_SCORE_THRESHOLD),
+        EMOTION_BATCH_SIZE,
+        EMOTION_BATCH_WAIT
+    )
+    expression_batcher = MicroBatcher('face-expression', expression_classifier.predict_proba,
+                                      EMOTION_BATCH_SIZE, EMOTION_BATCH_WAIT)
+except (OSError, KeyError, ValueError) as e:
+    face_detector = None
+    logger.warning(f"Emotion models not available ({str(e)}). Run scripts/download-models.js to enable "
+                   f"/api/detect-emotion.")
+
+def describe_faces(boxes, scores, probabilities):
+    """Build the per-image detection result, most confident face first."""
+    faces = []
+    for box, score, proba in zip(boxes, scores, probabilities):
+        best = int(np.argmax(proba))
+        faces.append({
+            'box': {
+                'x': float(box[0]),
+                'y': float(box[1]),
+                'width': float(box[2] - box[0]),
+                'height': float(box[3] - box[1])
+            },
+            'score': float(score),
+            'emotion': emotion_model.FACE_EXPRESSION_LABELS[best],
+            'confidence': float(proba[best]),
+            'expressions': {label: float(p) for label, p in zip(emotion_model.FACE_EXPRESSION_LABELS, proba)}
+        })
+    faces.sort(key=lambda face: face['score'], reverse=True)
+    
+    if not faces:
+        return {'success': False, 'error': 'No face detected', 'faces': [], 'demo': False}
+    return {
+        'success': True,
+        'emotion': faces[0]['emotion'],
+        'confidence': faces[0]['confidence'],
+        'faces': faces,
+        'demo': False
+    }
+
+@app.route('/api/detect-emotion', methods=['POST'])
+@admission_controlled(MAX_UPLOAD_LENGTH, EMOTION_REQUEST_DEADLINE, pool='emotion')
+def detect_emotion():
+    """API endpoint to detect facial expressions in one or more uploaded images."""
+    try:
+        if request.form.get('demo') == 'true':
+            return jsonify({
+                'success': True,
+                'emotion': random.choice(emotion_model.FACE_EXPRESSION_LABELS),
+                'confidence': 0.7 + random.random() * 0.3,
+                'demo': True
+            })
+        
+        files = request.files.getlist('image') + request.files.getlist('images')
+        if not files:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+        if len(files) > MAX_IMAGES_PER_REQUEST:
+            return jsonify({'success': False, 'error': f"At most {MAX_IMAGES_PER_REQUEST} images per request"}), 400
+        if face_detector is None:
+            return jsonify({'success': False, 'error': 'Emotion detection models are not available'}), 503
+        
+        logger.info(f"Received emotion detection request: {len(files)} images")
+        
+        # Decode and resize uploads in the worker pool
+        check_deadline('decode')
+        decoded = wait_for_stage(
+            [decode_pool.submit(emotion_model.decode_image, f.read()) for f in files], 'decode'
+        )
+        
+        # Detect faces, batched with other requests
+        check_deadline('detect')
+        detections = wait_for_stage(
+            [detection_batcher.submit(detector_input) for _, detector_input, _ in decoded], 'detect'
+        )
+        
+        # Convert boxes from the padded square input to pixels of the decoded image
+        face_boxes = []
+        for (image, _, _), (boxes, scores) in zip(decoded, detections):
+            side = max(image.size)
+            boxes = np.clip(boxes * side, 0, [image.width, image.height, image.width, image.height])
+            keep = (boxes[:, 2] - boxes[:, 0] >= 1) & (boxes[:, 3] - boxes[:, 1] >= 1)
+            face_boxes.append((boxes[keep], scores[keep]))
+        
+        # Crop faces in the worker pool and classify them, batched with other requests
+        check_deadline('classify')
+        face_inputs = wait_for_stage(
+            [decode_pool.submit(emotion_model.prepare_face, image, box)
+             for (image, _, _), (boxes, _) in zip(decoded, face_boxes) for box in boxes],
+            'classify'
+        )
+        probabilities = wait_for_stage(
+            [expression_batcher.submit(face_input) for face_input in face_inputs], 'classify'
+        )
+        
+        # Report boxes in pixels of the original upload, which may have been downscaled
+        results = []
+        for (image, _, (width, height)), (boxes, scores) in zip(decoded, face_boxes):
+            scale = np.array([width / image.width, height / image.height] * 2)
+            results.append(describe_faces(boxes * scale, scores, probabilities[:len(boxes)]))
+            probabilities = probabilities[len(boxes):]
+        
+        logger.info(f"Emotion detection result: {sum(len(r['faces']) for r in results)} faces")
+        
+        if len(results) == 1:
+            return jsonify(results[0])
+        return jsonify({
+            'success': any(result['success'] for result in results),
+            'results': results,
+            'demo': False
+        })
+    
+    except emotion_model.InvalidImage as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in detect_emotion: {str(e)}")
+        return reject('deadline_exceeded', 503, str(e), QUEUE_TIMEOUT)
+    
+    except Exception as e:
+        logger.error(f"Error in detect_emotion: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/models', methods=['GET'])
+def model_report():
+    """Report the serving configuration and per-model latency and disagreement rates."""
+    report = {}
+    with model_stats_lock:
+        for name, stats in model_stats.items():
+            latencies = np.array(stats['latencies']) * 1000
+            report[name] = {
+                'served': stats['served'],
+                'shadowed': stats['shadowed'],
+                'latency_ms': {
+                    'mean': float(latencies.mean()) if len(latencies) else None,
+                    'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                    'p95': float(np.percentile(latencies, 95)) if len(latencies) else None
+                },
+                'disagreement_rate': stats['disagreements'] / stats['compared'] if stats['compared'] else None,
+                'mean_probability_diff': stats['probability_diff_sum'] / stats['compared'] if stats['compared'] else None
+            }
+    
+    return jsonify({
+        **worker_identity(),
+        'primary': serving_config['primary'],
+        'shadow': serving_config['shadow'],
+        'split': serving_config['split'],
+        'vectorizers': len(vectorizers),
+        'models': report
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Report queue depth and rejection counts of this worker process."""
+    with admission_lock:
+        stats = copy.deepcopy(admission_stats)
+        stats['tracked_clients'] = len(client_buckets)
+    stats.update(worker_identity())
+    for name, pool in admission_pools.items():
+        stats['pools'][name].update(pool)
+    stats['feedback_queue_size'] = pending_feedback_count()
+    return jsonify(stats)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
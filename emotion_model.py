@@ -0,0 +1,275 @@
+import io
+import os
+import json
+import numpy as np
+from PIL import Image, ImageOps
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Expression labels in the order of the face_expression model outputs
+FACE_EXPRESSION_LABELS = ['neutral', 'happy', 'sad', 'angry', 'fearful', 'disgusted', 'surprised']
+
+class InvalidImage(Exception):
+    """Raised when an uploaded file cannot be decoded as an image."""
+
+# Weight loading
+def load_weights(models_dir, model_name):
+    """Load a face-api.js weights manifest and its shards into a dict of arrays."""
+    manifest_path = os.path.join(models_dir, f"{model_name}-weights_manifest.json")
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    weights = {}
+    for group in manifest:
+        paths = group.get('paths') or [f"{model_name}-shard1"]
+        data = b''.join(open(os.path.join(models_dir, path), 'rb').read() for path in paths)
+
+        offset = 0
+        for spec in group['weights']:
+            size = int(np.prod(spec['shape']))
+            quantization = spec.get('quantization')
+
+            # Quantized weights are stored as integers with a scale and offset
+            dtype = np.dtype(quantization['dtype'] if quantization else spec['dtype']).newbyteorder('<')
+            values = np.frombuffer(data, dtype=dtype, count=size, offset=offset).astype(np.float32)
+            offset += size * dtype.itemsize
+            if quantization:
+                values = values * quantization['scale'] + quantization['min']
+
+            weights[spec['name']] = values.reshape(spec['shape']).astype(np.float32)
+
+    return weights
+
+# Network layers (NHWC tensors)
+def same_padding(size, kernel, stride):
+    """Return the (before, after) padding TensorFlow uses for 'same' convolutions."""
+    out_size = -(-size // stride)
+    total = max((out_size - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+def pad_input(x, kernel, stride, padding, value=0.0):
+    """Pad a batch for a 'same' or 'valid' window operation."""
+    if padding == 'valid':
+        return x
+    pad_h = same_padding(x.shape[1], kernel, stride)
+    pad_w = same_padding(x.shape[2], kernel, stride)
+    if pad_h == (0, 0) and pad_w == (0, 0):
+        return x
+    return np.pad(x, ((0, 0), pad_h, pad_w, (0, 0)), constant_values=value)
+
+def window_slices(x, kernel, stride):
+    """Yield each kernel offset with the strided input slice it multiplies."""
+    out_h = (x.shape[1] - kernel) // stride + 1
+    out_w = (x.shape[2] - kernel) // stride + 1
+    for i in range(kernel):
+        for j in range(kernel):
+            yield i, j, x[:, i:i + stride * (out_h - 1) + 1:stride, j:j + stride * (out_w - 1) + 1:stride, :]
+
+def conv2d(x, filters, bias, stride=1, padding='same'):
+    """Standard convolution with filters shaped (k, k, in, out)."""
+    x = pad_input(x, filters.shape[0], stride, padding)
+    out = None
+    for i, j, patch in window_slices(x, filters.shape[0], stride):
+        term = patch @ filters[i, j]
+        out = term if out is None else out + term
+    return out + bias
+
+def separable_conv2d(x, depthwise_filter, pointwise_filter, bias, stride=1, padding='same'):
+    """Depthwise convolution followed by a 1x1 pointwise convolution."""
+    x = pad_input(x, depthwise_filter.shape[0], stride, padding)
+    out = None
+    for i, j, patch in window_slices(x, depthwise_filter.shape[0], stride):
+        term = patch * depthwise_filter[i, j, :, 0]
+        out = term if out is None else out + term
+    return out @ pointwise_filter[0, 0] + bias
+
+def max_pool(x, size, stride):
+    """Max pooling with 'same' padding."""
+    x = pad_input(x, size, stride, 'same', value=-np.inf)
+    out = None
+    for _, _, patch in window_slices(x, size, stride):
+        out = patch if out is None else np.maximum(out, patch)
+    return out
+
+def relu(x):
+    return np.maximum(x, 0)
+
+def leaky_relu(x):
+    return np.where(x > 0, x, 0.1 * x)
+
+def sigmoid(x):
+    return np.exp(-np.logaddexp(0, -x))
+
+def softmax(x):
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+def non_max_suppression(boxes, scores, iou_threshold):
+    """Return indices of the boxes kept by greedy non-maximum suppression."""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while len(order) > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+
+        # Intersection over union with the remaining boxes
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=int)
+
+# Models
+class TinyFaceDetector:
+    """Port of the face-api.js tiny face detector (TinyYolov2 with separable convolutions)."""
+
+    input_size = 416
+    mean_rgb = np.array([117.001, 114.697, 97.404], dtype=np.float32)
+    anchors = np.array([
+        [1.603231, 2.094468],
+        [6.041143, 7.080126],
+        [2.882459, 3.518061],
+        [4.266906, 5.178857],
+        [9.041765, 10.66308]
+    ], dtype=np.float32)
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def separable_block(self, x, name):
+        w = self.weights
+        out = separable_conv2d(x, w[f'{name}/depthwise_filter'], w[f'{name}/pointwise_filter'], w[f'{name}/bias'])
+        return leaky_relu(out)
+
+    def forward(self, batch):
+        """Run the network on a (N, 416, 416, 3) RGB batch and return the raw grid outputs."""
+        w = self.weights
+        x = (batch - self.mean_rgb) / 256
+
+        x = leaky_relu(conv2d(x, w['conv0/filters'], w['conv0/bias'], padding='valid'))
+        x = max_pool(x, 2, 2)
+        for name in ['conv1', 'conv2', 'conv3', 'conv4']:
+            x = max_pool(self.separable_block(x, name), 2, 2)
+        x = max_pool(self.separable_block(x, 'conv5'), 2, 1)
+        for name in ['conv6', 'conv7']:
+            if f'{name}/bias' in w:
+                x = self.separable_block(x, name)
+
+        return conv2d(x, w['conv8/filters'], w['conv8/bias'], padding='valid')
+
+    def detect(self, batch, score_threshold=0.5, iou_threshold=0.4):
+        """Detect faces and return one (boxes, scores) pair per image.
+
+        Boxes are (x0, y0, x1, y1) relative to the padded square input.
+        """
+        out = self.forward(batch)
+        num_images, num_cells = out.shape[0], out.shape[1]
+        out = out.reshape(num_images, num_cells, num_cells, len(self.anchors), 5)
+        scores = sigmoid(out[..., 4])
+
+        results = []
+        for b in range(num_images):
+            rows, cols, anchor_idx = np.nonzero(scores[b] > score_threshold)
+            encoded = out[b, rows, cols, anchor_idx]
+
+            center_x = (cols + sigmoid(encoded[:, 0])) / num_cells
+            center_y = (rows + sigmoid(encoded[:, 1])) / num_cells
+            width = np.exp(encoded[:, 2]) * self.anchors[anchor_idx, 0] / num_cells
+            height = np.exp(encoded[:, 3]) * self.anchors[anchor_idx, 1] / num_cells
+            boxes = np.stack([center_x - width / 2, center_y - height / 2,
+                              center_x + width / 2, center_y + height / 2], axis=1)
+
+            image_scores = scores[b, rows, cols, anchor_idx]
+            keep = non_max_suppression(boxes, image_scores, iou_threshold)
+            results.append((boxes[keep], image_scores[keep]))
+
+        return results
+
+class FaceExpressionNet:
+    """Port of the face-api.js face expression classifier."""
+
+    input_size = 112
+    mean_rgb = np.array([122.782, 117.001, 104.298], dtype=np.float32)
+
+    def __init__(self, weights):
+        if 'fc/weights' not in weights:
+            raise KeyError("face_expression weights have no fc layer")
+        self.weights = weights
+        self.blocks = sorted({name.split('/')[0] for name in weights if name.startswith('dense')})
+
+    def dense_block(self, x, name, is_first):
+        w = self.weights
+        num_convs = sum(1 for key in w if key.startswith(f'{name}/conv') and key.endswith('/bias'))
+
+        if is_first:
+            out = relu(conv2d(x, w[f'{name}/conv0/filters'], w[f'{name}/conv0/bias'], stride=2))
+        else:
+            out = relu(separable_conv2d(x, w[f'{name}/conv0/depthwise_filter'], w[f'{name}/conv0/pointwise_filter'],
+                                        w[f'{name}/conv0/bias'], stride=2))
+
+        # Each conv sees the sum of all previous outputs in the block
+        total = out
+        for i in range(1, num_convs):
+            conv = f'{name}/conv{i}'
+            total = total + separable_conv2d(out, w[f'{conv}/depthwise_filter'], w[f'{conv}/pointwise_filter'], w[f'{conv}/bias'])
+            out = relu(total)
+        return out
+
+    def predict_proba(self, batch):
+        """Return expression probabilities for a (N, 112, 112, 3) RGB batch of face crops."""
+        x = (batch - self.mean_rgb) / 255
+        for i, name in enumerate(self.blocks):
+            x = self.dense_block(x, name, is_first=(i == 0))
+        features = x.mean(axis=(1, 2))
+        return softmax(features @ self.weights['fc/weights'] + self.weights['fc/bias'])
+
+def load_models(models_dir):
+    """Load the face detector and expression classifier from a models directory."""
+    detector = TinyFaceDetector(load_weights(models_dir, 'tiny_face_detector_model'))
+    classifier = FaceExpressionNet(load_weights(models_dir, 'face_expression_model'))
+    return detector, classifier
+
+# Image preparation
+def fit_to_square(image, size, center):
+    """Resize an image to fit a size x size square and pad the rest with black."""
+    scale = size / max(image.size)
+    width, height = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    resized = image.resize((width, height), Image.BILINEAR)
+
+    canvas = Image.new('RGB', (size, size))
+    offset = ((size - width) // 2, (size - height) // 2) if center else (0, 0)
+    canvas.paste(resized, offset)
+    return np.asarray(canvas, dtype=np.float32)
+
+def decode_image(data, max_side=1600):
+    """Decode an uploaded image and prepare the face detector input.
+
+    Returns the upright, possibly downscaled image, the detector input and the
+    upright size of the original upload, which boxes are reported in.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_size = image.size
+        if image.getexif().get(0x0112, 1) in TRANSPOSED_ORIENTATIONS:
+            original_size = original_size[::-1]
+
+        # Let JPEG decode at a reduced scale when the photo is much larger than needed
+        image.draft('RGB', (max_side, max_side))
+
+        # Turn rotated phone photos upright before looking for faces
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"Invalid image: {str(e)}")
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+
+    return image, fit_to_square(image, TinyFaceDetector.input_size, center=False), original_size
+
+def prepare_face(image, box):
+    """Crop a face box given in pixels and prepare the expression classifier input."""
+    return fit_to_square(image.crop(tuple(int(round(v)) for v in box)), FaceExpressionNet.input_size, center=True)
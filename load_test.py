@@ -0,0 +1,444 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import logging
+import urllib.request
+import urllib.error
+from datetime import datetime
+import numpy as np
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Words used to build fixture articles
+REAL_WORDS = [
+    'government', 'policy', 'report', 'study', 'data', 'official', 'meeting', 'budget',
+    'council', 'research', 'minister', 'analysis', 'committee', 'statement', 'economy'
+]
+FAKE_WORDS = [
+    'shocking', 'secret', 'exposed', 'truth', 'hidden', 'miracle', 'banned', 'cure',
+    'hoax', 'conspiracy', 'bombshell', 'unbelievable', 'outrageous', 'scandal', 'urgent'
+]
+
+# Request types the load generator can send
+ENDPOINTS = {
+    'analyze': ('/api/analyze', {}),
+    'analyze_score': ('/api/analyze', {'outputs': []}),
+    'analyze_sentences': ('/api/analyze', {'sentences': True}),
+    'explain': ('/api/explain', {'outputs': ['features']}),
+    'health': ('/api/health', None)
+}
+
+def make_article(rng, num_words, fake):
+    """Generate an article of roughly num_words words."""
+    words = FAKE_WORDS if fake else REAL_WORDS
+    sentences = []
+    while sum(len(sentence) for sentence in sentences) < num_words:
+        sentence = [rng.choice(words + REAL_WORDS[:5]) for _ in range(rng.randint(8, 20))]
+        if fake and rng.random() < 0.3:
+            sentence[0] = sentence[0].upper()
+        sentences.append(sentence)
+    return ' '.join(
+        ' '.join(sentence).capitalize() + ('!' if fake and rng.random() < 0.3 else '.')
+        for sentence in sentences
+    )
+
+def build_fixture(work_dir, seed=42):
+    """Train a small model on generated articles and save it where app.py expects it."""
+    rng = random.Random(seed)
+    texts = [make_article(rng, 200, fake=i % 2 == 1) for i in range(400)]
+    labels = [i % 2 for i in range(400)]
+
+    vectorizer = TfidfVectorizer(max_features=5000, ngram_range=(1, 2))
+    X = vectorizer.fit_transform(texts)
+    model = LogisticRegression(max_iter=1000, random_state=seed)
+    model.fit(X, labels)
+
+    models_dir = os.path.join(work_dir, 'models')
+    os.makedirs(models_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(models_dir, 'fake_news_model.pkl'))
+    joblib.dump(vectorizer, os.path.join(models_dir, 'tfidf_vectorizer.pkl'))
+    with open(os.path.join(models_dir, 'feature_names.json'), 'w') as f:
+        json.dump(list(vectorizer.get_feature_names_out()), f)
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def launch_server(work_dir, port, workers, threads, server_env):
+    """Start app.py under gunicorn (or Flask when gunicorn is missing) in work_dir."""
+    env = dict(os.environ)
+    env.update(server_env)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR, env.get('PYTHONPATH', '')])
+    env['PORT'] = str(port)
+
+    try:
+        import gunicorn  # noqa: F401
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--worker-class', 'gthread',
+            '--threads', str(threads),
+            'app:app'
+        ]
+    except ImportError:
+        logger.warning("gunicorn not installed, falling back to a single Flask process")
+        command = [sys.executable, os.path.join(REPO_DIR, 'app.py')]
+
+    log_file = open(os.path.join(work_dir, 'server.log'), 'w')
+    return subprocess.Popen(command, cwd=work_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+def wait_until_healthy(base_url, process, timeout=120):
+    """Poll the health endpoint until the server answers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f'{base_url}/api/health', timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server did not become healthy within {timeout}s")
+
+# Memory sampling
+def child_pids(pid):
+    """Return the PIDs of a process's direct children (Linux only)."""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The parent PID is the second field after the command name
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+def rss_mb(pid):
+    """Return a process's resident set size in MB, or None if it is gone."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+class MemorySampler:
+    """Sample the RSS of every server worker in the background."""
+
+    def __init__(self, server_pid, interval=1.0):
+        self.server_pid = server_pid
+        self.interval = interval
+        self.samples = []  # (seconds since start, {pid: rss_mb})
+        self.stopped = threading.Event()
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            pids = child_pids(self.server_pid) or [self.server_pid]
+            sample = {pid: rss_mb(pid) for pid in pids}
+            self.samples.append((time.monotonic() - self.start_time, {p: r for p, r in sample.items() if r is not None}))
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if os.path.isdir('/proc'):
+            self.thread.start()
+        else:
+            logger.warning("/proc not available, worker memory will not be reported")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def window(self, start, end):
+        """Return the samples taken between two offsets from the start."""
+        return [(t, sample) for t, sample in self.samples if start <= t <= end]
+
+# Load generation
+def send_request(base_url, endpoint, text):
+    """Send one request and return (latency in seconds, status code)."""
+    path, payload = ENDPOINTS[endpoint]
+    if payload is None:
+        request = urllib.request.Request(f'{base_url}{path}')
+    else:
+        body = dict(payload, text=text)
+        request = urllib.request.Request(
+            f'{base_url}{path}',
+            data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        status = 0
+    return time.perf_counter() - start, status
+
+def run_level(base_url, concurrency, duration, endpoint_mix, articles, seed):
+    """Run closed-loop clients at one concurrency level and return their results."""
+    results = []
+    results_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    endpoints, weights = zip(*endpoint_mix.items())
+
+    def client(client_id):
+        rng = random.Random(seed + client_id)
+        local = []
+        while time.monotonic() < stop_at:
+            endpoint = rng.choices(endpoints, weights)[0]
+            local.append((endpoint,) + send_request(base_url, endpoint, rng.choice(articles)))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def summarize_level(concurrency, duration, results, memory_samples):
+    """Compute throughput, latency percentiles, error rate and worker memory for a level."""
+    latencies = np.array([latency for _, latency, _ in results]) * 1000
+    errors = sum(1 for _, _, status in results if status != 200)
+
+    # Per-worker RSS over the level, to spot leaks
+    workers = {}
+    for t, sample in memory_samples:
+        for pid, rss in sample.items():
+            workers.setdefault(str(pid), []).append((round(t, 1), round(rss, 1)))
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput_rps': (len(results) - errors) / duration,  # Successful responses only
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+            'p99': float(np.percentile(latencies, 99)) if len(latencies) else None
+        },
+        'error_rate': errors / len(results) if results else 1.0,
+        'status_counts': {str(s): sum(1 for _, _, status in results if status == s)
+                          for s in sorted({status for _, _, status in results})},
+        'max_worker_rss_mb': max((rss for series in workers.values() for _, rss in series), default=None),
+        'worker_rss_mb': workers
+    }
+
+# Baselines
+BASELINE_CONFIG_KEYS = ['workers', 'threads', 'mix', 'sizes', 'duration']
+
+def compare_to_baseline(report, baseline, latency_tolerance, throughput_tolerance, error_tolerance,
+                        rss_tolerance, max_rss_growth_mb):
+    """Return a list of regressions against a stored baseline report."""
+    # Numbers from a different setup are not comparable, so report the mismatch instead
+    mismatches = [f"config '{key}' is {report['config'].get(key)!r}, baseline has {baseline.get('config', {}).get(key)!r}"
+                  for key in BASELINE_CONFIG_KEYS
+                  if report['config'].get(key) != baseline.get('config', {}).get(key)]
+    if mismatches:
+        return mismatches
+
+    regressions = []
+    baseline_levels = {level['concurrency']: level for level in baseline['levels']}
+
+    for level in report['levels']:
+        base = baseline_levels.get(level['concurrency'])
+        if base is None:
+            continue
+        c = level['concurrency']
+
+        for percentile in ['p50', 'p95', 'p99']:
+            value, reference = level['latency_ms'][percentile], base['latency_ms'][percentile]
+            if value is not None and reference is not None and value > reference * (1 + latency_tolerance):
+                regressions.append(f"c={c}: {percentile} latency {value:.1f}ms > baseline {reference:.1f}ms")
+
+        if level['throughput_rps'] < base['throughput_rps'] * (1 - throughput_tolerance):
+            regressions.append(f"c={c}: throughput {level['throughput_rps']:.1f} rps < "
+                               f"baseline {base['throughput_rps']:.1f} rps")
+
+        if level['error_rate'] > base['error_rate'] + error_tolerance:
+            regressions.append(f"c={c}: error rate {level['error_rate']:.3f} > baseline {base['error_rate']:.3f}")
+
+        value, reference = level['max_worker_rss_mb'], base.get('max_worker_rss_mb')
+        if value is not None and reference is not None and value > reference * (1 + rss_tolerance):
+            regressions.append(f"c={c}: worker RSS {value:.1f}MB > baseline {reference:.1f}MB")
+
+    # Memory that keeps growing across the measured levels points to a leak
+    for pid, growth in report['worker_rss_growth_mb'].items():
+        if growth > max_rss_growth_mb:
+            regressions.append(f"worker {pid}: RSS grew by {growth:.1f}MB during the run")
+
+    return regressions
+
+def parse_mix(value):
+    """Parse 'name:weight,name:weight' into a dict."""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}', choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def parse_ints(value):
+    return [int(v) for v in value.split(',')]
+
+def main():
+    """Main function to run the load test."""
+    parser = argparse.ArgumentParser(description="Load test app.py locally with a fixture model.")
+    parser.add_argument('--concurrency', type=parse_ints, default=[1, 4, 16],
+                        help="Comma-separated concurrency levels to run in order (default: 1,4,16)")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of warm-up before the first level")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('analyze:5,analyze_score:3,analyze_sentences:1,explain:1'),
+                        help="Endpoint mix as name:weight pairs (endpoints: " + ', '.join(ENDPOINTS) + ")")
+    parser.add_argument('--sizes', type=parse_ints, default=[100, 800, 5000],
+                        help="Comma-separated article sizes in words")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=8, help="Threads per gunicorn worker")
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Extra environment for the server, e.g. MAX_IN_FLIGHT=8 (repeatable)")
+    parser.add_argument('--output', default=None, help="Report path (default: results/load_test_<timestamp>.json)")
+    parser.add_argument('--baseline', default=None, help="Baseline report to compare against")
+    parser.add_argument('--save-baseline', default=None, help="Also save this report as a baseline")
+    parser.add_argument('--latency-tolerance', type=float, default=0.25, help="Allowed relative latency increase")
+    parser.add_argument('--throughput-tolerance', type=float, default=0.2, help="Allowed relative throughput drop")
+    parser.add_argument('--error-tolerance', type=float, default=0.01, help="Allowed absolute error rate increase")
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help="Allowed relative worker RSS increase")
+    parser.add_argument('--max-rss-growth-mb', type=float, default=50, help="Allowed worker RSS growth over the run")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # The load generator should measure the server, not its rate limits
+    server_env = {'RATE_LIMIT_BURST': '1000000', 'RATE_LIMIT_PER_MINUTE': '1000000000'}
+    server_env.update(item.split('=', 1) for item in args.server_env)
+
+    rng = random.Random(args.seed)
+    articles = [make_article(rng, size, fake=i % 2 == 1) for size in args.sizes for i in range(10)]
+
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    process = None
+    try:
+        logger.info(f"Building fixture model in {work_dir}")
+        build_fixture(work_dir, args.seed)
+
+        logger.info(f"Launching server on port {port} ({args.workers} workers x {args.threads} threads)")
+        process = launch_server(work_dir, port, args.workers, args.threads, server_env)
+        wait_until_healthy(base_url, process)
+
+        sampler = MemorySampler(process.pid)
+        sampler.start()
+
+        if args.warmup > 0:
+            run_level(base_url, 1, args.warmup, args.mix, articles, args.seed)
+        measure_start = time.monotonic() - sampler.start_time
+
+        levels = []
+        for concurrency in args.concurrency:
+            logger.info(f"Running {args.duration:.0f}s at concurrency {concurrency}...")
+            start = time.monotonic() - sampler.start_time
+            results = run_level(base_url, concurrency, args.duration, args.mix, articles, args.seed)
+            end = time.monotonic() - sampler.start_time
+            level = summarize_level(concurrency, args.duration, results, sampler.window(start, end))
+            levels.append(level)
+
+            logger.info(f"c={concurrency}: {level['throughput_rps']:.1f} rps, "
+                        f"p50 {level['latency_ms']['p50']:.1f}ms, p95 {level['latency_ms']['p95']:.1f}ms, "
+                        f"p99 {level['latency_ms']['p99']:.1f}ms, errors {level['error_rate']:.2%}, "
+                        f"max worker RSS {level['max_worker_rss_mb'] or 0:.1f}MB")
+
+        sampler.stop()
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # RSS growth per worker from the first sample after warm-up to the last, so
+    # model loading and first-request allocations are not counted as a leak
+    first_seen, last_seen = {}, {}
+    for _, sample in sampler.window(measure_start, float('inf')):
+        for pid, rss in sample.items():
+            first_seen.setdefault(str(pid), rss)
+            last_seen[str(pid)] = rss
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'config': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'mix': args.mix,
+            'sizes': args.sizes,
+            'workers': args.workers,
+            'threads': args.threads,
+            'server_env': server_env
+        },
+        'levels': levels,
+        'worker_rss_growth_mb': {pid: last_seen[pid] - first_seen[pid] for pid in last_seen}
+    }
+
+    output = args.output or os.path.join('results', f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved to {output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(
+            report, baseline, args.latency_tolerance, args.throughput_tolerance, args.error_tolerance,
+            args.rss_tolerance, args.max_rss_growth_mb
+        )
+        if regressions:
+            for regression in regressions:
+                logger.error(f"Regression: {regression}")
+            sys.exit(1)
+        logger.info("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
@@ -4,23 +4,28 @@ import os
 import re
 import json
 import pickle
+import shutil
+import tempfile
 import logging
 from datetime import datetime
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import train_test_split, HalvingGridSearchCV, StratifiedKFold
 from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.svm import LinearSVC
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 from sklearn.metrics import confusion_matrix, classification_report, roc_curve, auc
 import nltk
 from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
+from nltk.tokenize import word_tokenize, sent_tokenize
 from nltk.stem import WordNetLemmatizer
 import joblib
+from joblib import Memory
 
 # Configure logging
 logging.basicConfig(
@@ -49,24 +54,30 @@ os.makedirs('results', exist_ok=True)
 
 # Text preprocessing function
 def preprocess_text(text):
-    """Clean and preprocess the input text."""
+    """Clean and preprocess the input text.
+    
+    Matches the server's tokenize_text: markup is removed from the whole text,
+    which is then split into sentences and cleaned sentence by sentence.
+    """
     if not isinstance(text, str) or not text:
         return ""
     
-    # Convert to lowercase
-    text = text.lower()
-    
     # Remove URLs
-    text = re.sub(r'https?://\S+|www\.\S+', '', text)
+    text = re.sub(r'https?://\S+|www\.\S+', '', text, flags=re.IGNORECASE)
     
     # Remove HTML tags
     text = re.sub(r'<.*?>', '', text)
     
-    # Remove special characters and numbers (keep punctuation for now)
-    text = re.sub(r'[^a-zA-Z\s.,!?]', '', text)
-    
-    # Tokenize
-    tokens = word_tokenize(text)
+    tokens = []
+    for sentence in sent_tokenize(text):
+        # Convert to lowercase
+        sentence = sentence.lower()
+        
+        # Remove special characters and numbers (keep punctuation for now)
+        sentence = re.sub(r'[^a-zA-Z\s.,!?]', '', sentence)
+        
+        # Tokenize
+        tokens.extend(word_tokenize(sentence, preserve_line=True))
     
     # Remove stopwords
     stop_words = set(stopwords.words('english'))
@@ -108,7 +119,119 @@ def load_data(filepath):
     
     return df
 
-def train_and_evaluate_models(df, test_size=0.2, random_state=42):
+def build_param_grid(random_state=42):
+    """Define the hyperparameter search space for every vectorizer/model pair."""
+    vectorizer_grid = [
+        {
+            'vectorizer': [TfidfVectorizer(max_features=5000, min_df=5, max_df=0.7)],
+            'vectorizer__ngram_range': [(1, 1), (1, 2)],
+            'vectorizer__sublinear_tf': [False, True]
+        },
+        {
+            'vectorizer': [CountVectorizer(max_features=5000, min_df=5, max_df=0.7)],
+            'vectorizer__ngram_range': [(1, 1), (1, 2)]
+        }
+    ]
+    
+    model_grid = [
+        {
+            'model': [RandomForestClassifier(random_state=random_state, class_weight='balanced')],
+            'model__n_estimators': [100, 300],
+            'model__max_depth': [None, 50]
+        },
+        {
+            'model': [LogisticRegression(class_weight='balanced', max_iter=1000, random_state=random_state)],
+            'model__C': [0.1, 1.0, 10.0]
+        },
+        {
+            'model': [GradientBoostingClassifier(random_state=random_state)],
+            'model__n_estimators': [100, 200],
+            'model__learning_rate': [0.05, 0.1]
+        },
+        {
+            # Calibrated so the served model always has predict_proba
+            'model': [
+                CalibratedClassifierCV(LinearSVC(C=C, class_weight='balanced', max_iter=10000, random_state=random_state))
+                for C in [0.1, 1.0, 10.0]
+            ]
+        }
+    ]
+    
+    # Cross every vectorizer grid with every model grid
+    return [{**vec_params, **model_params} for vec_params in vectorizer_grid for model_params in model_grid]
+
+def halving_min_resources(n_samples, n_candidates, min_df, cv=3, factor=3):
+    """Return the sample count of the first halving round.
+    
+    The first round is large enough that every training fold has at least ten
+    documents per ``min_df``, and the rounds are spaced so the last one uses
+    (nearly) the whole training set.
+    """
+    floor = min(n_samples, -(-10 * min_df * cv // (cv - 1)))
+    
+    # Rounds possible from the floor up to the full set, capped by the rounds
+    # needed to narrow the candidates down to one
+    n_iterations = 1
+    while floor * factor ** n_iterations <= n_samples and factor ** n_iterations <= n_candidates:
+        n_iterations += 1
+    
+    return max(floor, n_samples // factor ** (n_iterations - 1))
+
+def search_hyperparameters(X_train, y_train, random_state=42, cv=3, factor=3, n_jobs=-1):
+    """Run a parallel successive-halving search and return the fitted search object.
+    
+    Candidates are scored on growing subsets of the training data and only the
+    best 1/factor of them survive each round. The pipeline caches fitted
+    vectorizers on disk, so each fold is vectorized once per vectorizer setting
+    and the resulting matrices are shared by every model configuration.
+    """
+    param_grid = build_param_grid(random_state)
+    n_candidates = sum(
+        int(np.prod([len(values) for values in params.values()])) for params in param_grid
+    )
+    min_df = max(vec.min_df for params in param_grid for vec in params['vectorizer'])
+    min_resources = halving_min_resources(len(X_train), n_candidates, min_df, cv=cv, factor=factor)
+    
+    cache_dir = tempfile.mkdtemp(prefix='vectorizer_cache_')
+    try:
+        pipeline = Pipeline([
+            ('vectorizer', TfidfVectorizer()),
+            ('model', LogisticRegression())
+        ], memory=Memory(cache_dir, verbose=0))
+        
+        search = HalvingGridSearchCV(
+            pipeline,
+            param_grid,
+            factor=factor,
+            min_resources=min_resources,
+            cv=StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state),
+            scoring='f1',
+            n_jobs=n_jobs,
+            random_state=random_state,
+            refit=True,
+            error_score='raise',  # A failing fit must not be scored NaN and cut at random
+            verbose=1
+        )
+        
+        logger.info(f"Searching hyperparameters (factor={factor}, cv={cv}, n_jobs={n_jobs}, "
+                    f"min_resources={min_resources})...")
+        search.fit(X_train, y_train)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    
+    # Save the full search trace, one row per candidate per halving iteration
+    trace_df = pd.DataFrame(search.cv_results_)
+    param_columns = [col for col in trace_df.columns if col.startswith('param_') or col == 'params']
+    trace_df[param_columns] = trace_df[param_columns].astype(str)
+    trace_df.to_csv('results/hyperparameter_search.csv', index=False)
+    
+    logger.info(f"Search completed after {search.n_iterations_} iterations "
+                f"({sum(search.n_candidates_)} candidate evaluations)")
+    logger.info(f"Best parameters: {search.best_params_} (CV F1: {search.best_score_:.4f})")
+    
+    return search
+
+def train_and_evaluate_models(df, test_size=0.2, random_state=42, search=True):
     """Train and evaluate multiple models."""
     logger.info("Starting model training and evaluation")
     
@@ -161,12 +284,12 @@ def train_and_evaluate_models(df, test_size=0.2, random_state=42):
             n_estimators=100,
             random_state=random_state
         ),
-        'linear_svc': LinearSVC(
+        'linear_svc': CalibratedClassifierCV(LinearSVC(
             C=1.0,
             class_weight='balanced',
             max_iter=10000,
             random_state=random_state
-        )
+        ))
     }
     
     # Train and evaluate each combination
@@ -189,6 +312,12 @@ def train_and_evaluate_models(df, test_size=0.2, random_state=42):
             # Train the model
             model.fit(X_train_vec, y_train)
             
+            # Save every combination as a bundle the server can load side by side
+            bundle_dir = os.path.join('models', 'bundles', f'{vec_name}_{model_name}')
+            os.makedirs(bundle_dir, exist_ok=True)
+            joblib.dump(model, os.path.join(bundle_dir, 'model.pkl'))
+            joblib.dump(vectorizer, os.path.join(bundle_dir, 'vectorizer.pkl'))
+            
             # Make predictions
             y_pred = model.predict(X_test_vec)
             
@@ -225,6 +354,16 @@ def train_and_evaluate_models(df, test_size=0.2, random_state=42):
     
     logger.info(f"Best model: {best_model_name} with {best_vec_name} vectorizer (F1: {best_f1:.4f})")
     
+    # Tune hyperparameters and use the chosen configuration for the saved artifacts
+    if search:
+        search_result = search_hyperparameters(X_train, y_train, random_state=random_state)
+        best_vectorizer = search_result.best_estimator_.named_steps['vectorizer']
+        best_model = search_result.best_estimator_.named_steps['model']
+        
+        tuned_f1 = f1_score(y_test, best_model.predict(best_vectorizer.transform(X_test)))
+        logger.info(f"Tuned model: {type(best_model).__name__} with {type(best_vectorizer).__name__} "
+                    f"(test F1: {tuned_f1:.4f})")
+    
     # Detailed evaluation of the best model
     X_test_vec = best_vectorizer.transform(X_test)
     y_pred = best_model.predict(X_test_vec)
@@ -275,6 +414,21 @@ def train_and_evaluate_models(df, test_size=0.2, random_state=42):
     
     logger.info("Model and vectorizer saved successfully!")
     
+    # Train an online-learnable variant on the same features so the server can
+    # apply labeled feedback incrementally with partial_fit
+    online_model = SGDClassifier(
+        loss='modified_huber',  # Supports predict_proba and partial_fit
+        alpha=1e-4,
+        random_state=random_state
+    )
+    online_model.fit(best_vectorizer.transform(X_train), y_train)
+    joblib.dump(online_model, 'models/online_model.pkl')
+    
+    # Save the held-out set used to guard online updates
+    joblib.dump({'text': list(X_test), 'label': list(y_test)}, 'models/holdout.pkl')
+    
+    logger.info("Online model and held-out set saved successfully!")
+    
     return best_model, best_vectorizer, results_df
 
 def main():